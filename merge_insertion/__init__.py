@@ -49,8 +49,12 @@ API
 
 .. autoclass:: merge_insertion.Comparator
 
+.. autoclass:: merge_insertion.SyncComparator
+
 .. autofunction:: merge_insertion.merge_insertion_sort
 
+.. autofunction:: merge_insertion.merge_insertion_sort_sync
+
 .. autofunction:: merge_insertion.merge_insertion_max_comparisons
 
 Author, Copyright and License
@@ -70,12 +74,17 @@ WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
 ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 """
-from collections.abc import Generator, Sequence, Callable, Awaitable
-from typing import TypeVar, Literal
-from math import floor, ceil, log2
+from collections.abc import Generator, Sequence, MutableSequence, Callable, Awaitable
+from typing import TypeVar, Literal, cast
+from bisect import bisect_left
+from itertools import islice, permutations
+from functools import lru_cache
+from array import array as _array
 
 #: A type of object that can be compared by a :class:`Comparator` and therefore sorted by
-#: :func:`merge_insertion_sort`. Must have sensible support for the equality operators.
+#: :func:`merge_insertion_sort`. Must be hashable and have sensible support for the equality operators,
+#: as these are used to check that the items to be sorted are unique, unless that check is changed via
+#: the ``check_unique`` parameter of the sort functions. The sort itself uses neither.
 T = TypeVar('T')
 
 # Helper that generates the group sizes for _make_groups.
@@ -91,90 +100,209 @@ def _group_sizes() -> Generator[int, None, None]:
         prev = cur
         i += 1
 
+# The group sizes, precomputed so _make_groups doesn't need to run the generator every time.
+# The first 64 groups add up to more than 2**64 items, which is far more than can ever be sorted.
+_GROUP_SIZES :tuple[int, ...] = tuple(islice(_group_sizes(), 64))
+
 # Helper function to group and reorder items to be inserted via binary search.
 # See also the description within the code of merge_insertion_sort.
-def _make_groups(array :Sequence[T]) -> Sequence[tuple[int, T]]:
-    items = list(enumerate(array))
-    rv :list[tuple[int, T]] = []
-    gen = _group_sizes()
+def _make_groups(array :Sequence[T]) -> Generator[tuple[int, T], None, None]:
     i :int = 0
-    while True:
-        size = next(gen)
-        group = items[i:i+size]
-        group.reverse()
-        rv.extend(group)
-        if len(group)<size:
+    for size in _GROUP_SIZES:
+        if i >= len(array):
             break
-        i += size
-    return rv
+        end = min(i + size, len(array))
+        # Iterating over the group in reverse is handed off to the builtins instead of looping in Python.
+        yield from zip(range(end-1, i-1, -1), reversed(array[i:end]))
+        i = end
 
 #: A user-supplied async function to compare two items.
 #: The single argument is a tuple of the two items to be compared; they must not be equal.
 #: Must return 0 if the first item is ranked higher, or 1 if the second item is ranked higher.
+#: :func:`merge_insertion_sort` never compares the same two items more than once,
+#: so there is no need for the comparator to cache its results.
 Comparator = Callable[[tuple[T, T]], Awaitable[Literal[0, 1]]]
 
+#: A user-supplied regular (non-async) function to compare two items, for use with :func:`merge_insertion_sort_sync`.
+#: Otherwise identical to :class:`Comparator`.
+SyncComparator = Callable[[tuple[T, T]], Literal[0, 1]]
+
+_R = TypeVar('_R')
+# The algorithm is implemented as generators that yield the comparisons they need and are sent the results,
+# so that the same code can be used with both async and sync comparators. The items to be compared are given
+# as their indices into the array being sorted. Each yielded value is a list of comparisons that are
+# independent of one another, and the results must be sent back as a list in the same order.
+_Comparisons = Generator[list[tuple[int, int]], Sequence[Literal[0, 1]], _R]
+
+# Runs one of the above generators to completion using an async comparator on the given items.
+async def _run_async(gen :_Comparisons[_R], items :Sequence[T], comp :Comparator, parallel :bool) -> _R:
+    results :Sequence[Literal[0, 1]]|None = None
+    while True:
+        try:
+            batch = next(gen) if results is None else gen.send(results)
+        except StopIteration as ex:
+            return cast(_R, ex.value)
+        # Most batches consist of a single comparison, so avoid the overhead of the async comprehension for those.
+        if len(batch)==1:
+            a, b = batch[0]
+            results = [ await comp((items[a], items[b])) ]
+        elif parallel:
+            # Imported here so the sync API doesn't have to pay for importing asyncio.
+            import asyncio  # pylint: disable=import-outside-toplevel
+            results = await asyncio.gather(*( comp((items[a], items[b])) for a,b in batch ))
+        else:
+            results = [ await comp((items[a], items[b])) for a,b in batch ]
+
+# Runs one of the above generators to completion using a sync comparator on the given items.
+def _run_sync(gen :_Comparisons[_R], items :Sequence[T], comp :SyncComparator) -> _R:
+    results :Sequence[Literal[0, 1]]|None = None
+    while True:
+        try:
+            batch = next(gen) if results is None else gen.send(results)
+        except StopIteration as ex:
+            return cast(_R, ex.value)
+        # Most batches consist of a single comparison, so avoid the loop overhead for those.
+        if len(batch)==1:
+            a, b = batch[0]
+            results = [ comp((items[a], items[b])) ]
+        else:
+            results = [ comp((items[a], items[b])) for a,b in batch ]
+
 # Helper function to insert an item into a sorted array via binary search.
 # Returns the index **before** which to insert the new item, e.g. `array.insert(index, item)`
-async def _bin_insert_index(array :Sequence[T], item :T, comp :Comparator) -> int:
-    if not array:
+# The item must not already be in the array; this always holds because the values searched are unique indices.
+# If `hi` is given, only `array[:hi]` is searched, without having to make a copy of that slice.
+def _bin_insert_index(array :Sequence[int], item :int, hi :int|None = None) -> _Comparisons[int]:
+    size = len(array) if hi is None else hi
+    if not size:
         return 0
-    if item in array:
-        raise ValueError("item is already in target array")
-    if len(array)==1:
-        return 0 if await comp((item,array[0])) else 1
-    left, right = 0, len(array)-1
+    if size==1:
+        return 0 if (yield [(item, array[0])])[0] else 1
+    left, right = 0, size-1
     while left <= right:
-        mid = left + floor((right-left)/2)
-        if await comp((item, array[mid])):
+        mid = (left+right) >> 1
+        if (yield [(item, array[mid])])[0]:
             right = mid - 1
         else:
             left = mid + 1
     return left
 
-# Finds the index of an object in an array by object identity (instead of equality).
-def _ident_find(array :Sequence[T], item :T) -> int:
-    for i,e in enumerate(array):
-        if e is item:
-            return i
-    raise IndexError(f"failed to find item {item!r} in array")
+# Error checking common to merge_insertion_sort and merge_insertion_sort_sync.
+def _check_array(array :Sequence[T], check_unique :bool|Literal['identity']) -> None:
+    if len(array)<2 or not check_unique:
+        return
+    unique = len({ id(item) for item in array }) if check_unique=='identity' else len(set(array))
+    if unique != len(array):
+        raise ValueError('array may not contain duplicate items')
 
-async def merge_insertion_sort(array :Sequence[T], comparator :Comparator) -> Sequence[T]:
+async def merge_insertion_sort(array :Sequence[T], comparator :Comparator, *, parallel :bool = False,
+                               check_unique :bool|Literal['identity'] = True) -> Sequence[T]:
     """Merge-Insertion Sort (Ford-Johnson algorithm) with async comparison.
 
     :param array: Array to sort. **Duplicate items are not allowed.**
     :param comparator: Async comparison function as described in :class:`Comparator`.
+    :param parallel: The comparisons that form the initial pairs of items are independent of one another,
+        so if this option is set, they are run concurrently via :func:`asyncio.gather`. This can speed things
+        up when the comparator is e.g. a network request, but should not be used when it asks a user.
+    :param check_unique: How to check that the items in the array are unique before sorting. If true (the default),
+        the items are hashed and compared for equality as described in :class:`T`. If ``"identity"``, only checks
+        that no object occurs more than once, which also works for items that are not hashable. If false, no check
+        is done and the caller is responsible for ensuring that the items are unique.
     :return: A shallow copy of the array sorted in ascending order.
     """
-    # Special cases and error checking
-    if len(array)<1:
-        return []
-    if len(array)==1:
-        return list(array)
-    if len(array) != len(set(array)):
-        raise ValueError('array may not contain duplicate items')
-    if len(array)==2:
-        return list(array) if await comparator((array[0], array[1])) else [array[1], array[0]]
+    _check_array(array, check_unique)
+    order = await _run_async(_merge_insertion_sort(len(array)), array, comparator, parallel)
+    return [ array[i] for i in order ]
 
+def merge_insertion_sort_sync(array :Sequence[T], comparator :SyncComparator, *,
+                              check_unique :bool|Literal['identity'] = True) -> Sequence[T]:
+    """Merge-Insertion Sort (Ford-Johnson algorithm) with sync comparison.
+
+    This performs exactly the same comparisons as :func:`merge_insertion_sort`, but avoids the overhead
+    of the async machinery when the comparator doesn't need it.
+
+    :param array: Array to sort. **Duplicate items are not allowed.**
+    :param comparator: Comparison function as described in :class:`SyncComparator`.
+    :param check_unique: As described in :func:`merge_insertion_sort`.
+    :return: A shallow copy of the array sorted in ascending order.
+    """
+    _check_array(array, check_unique)
+    order = _run_sync(_merge_insertion_sort(len(array)), array, comparator)
+    return [ array[i] for i in order ]  # pylint: disable=not-an-iterable  # false positive, it's the generator's return value
+
+# The actual implementation of the sort, see the explanation of _Comparisons above. Instead of the items
+# themselves, this sorts their indices into the input array, from 0 to n-1, and returns them in sorted order.
+# This means the items never need to be copied, hashed, or looked up by identity while sorting.
+def _merge_insertion_sort(n :int) -> _Comparisons[MutableSequence[int]]:
+    if n >= len(_SMALL_TREES):
+        return (yield from _merge_insertion_levels(n))
+    # Small inputs are common (e.g. when sorting many short lists), and for those, the bookkeeping of the general
+    # algorithm costs much more than simply walking its precomputed decision tree, which needs none at all.
+    tree = _SMALL_TREES[n]
+    path :tuple[int, ...] = ()
+    while isinstance(node := tree[path], list):
+        # The tree is keyed on 0 and 1, but like the general algorithm, accept any true or false result;
+        # since False and True are equal to and hash the same as 0 and 1, converting to bool is enough.
+        path += tuple(map(bool, (yield node)))
+    return list(node)
+
+# The general case of _merge_insertion_sort.
+def _merge_insertion_levels(n :int) -> _Comparisons[MutableSequence[int]]:
     # Algorithm description adapted and expanded from <https://en.wikipedia.org/wiki/Merge-insertion_sort>:
     # 1. Group the items into ⌊n/2⌋ pairs of elements, arbitrarily, leaving one element unpaired if there is an odd number of elements.
     # 2. Perform ⌊n/2⌋ comparisons, one per pair, to determine the larger of the two elements in each pair.
-    pairs :dict[T, T] = {}  # keys are the larger items, values the smaller ones
-    for i in range(0, len(array)-1, 2):
-        if await comparator((array[i], array[i+1])):
-            pairs[array[i+1]] = array[i]
-        else:
-            pairs[array[i]] = array[i+1]
-
     # 3. Recursively sort the ⌊n/2⌋ larger elements from each pair, creating an initial sorted output sequence
     #    of ⌊n/2⌋ of the input elements, in ascending order, using the merge-insertion sort.
-    larger = await merge_insertion_sort(list(pairs), comparator)
+    # (Steps 4 and 5 are in _insert_smaller below.)
+    #
+    # Instead of actually recursing, steps 1 and 2 are repeated on the larger elements until at most two items
+    # are left (the special cases of the recursion), and each of these levels is remembered. Then, the levels are
+    # worked through in reverse, each time inserting the smaller elements into the sorted larger elements, whose
+    # result is the sorted sequence of larger elements for the next level. This makes exactly the same comparisons
+    # in the same order as the recursive version.
+    #
+    # The sorted indices are kept in compact arrays of machine integers instead of lists of int objects. Inserting
+    # into these arrays (which moves all of the following entries) is the most expensive part of the bookkeeping
+    # for large inputs, and this way, much less memory needs to be moved around.
+    typecode = 'I' if n < 2**32 else 'Q'
+    array :Sequence[int] = range(n)
+    levels :list[tuple[Sequence[int], dict[int, int]]] = []
+    while len(array)>2:
+        pairs :list[tuple[int, int]] = [ (array[i], array[i+1]) for i in range(0, len(array)-1, 2) ]
+        results = yield pairs
+        larger_arr :list[int] = []
+        # The smaller partner of each of the larger items.
+        partner :dict[int, int] = {}
+        for (a, b), res in zip(pairs, results):
+            larger, smaller = (b, a) if res else (a, b)
+            larger_arr.append(larger)
+            partner[larger] = smaller
+        levels.append((array, partner))
+        array = larger_arr
+
+    # Special cases
+    rv :MutableSequence[int] = _array(typecode, array)
+    if len(array)==2 and not (yield [(array[0], array[1])])[0]:
+        rv.reverse()
+
+    while levels:
+        array, partner = levels.pop()
+        # The smaller item of each pair, in the order of the sorted larger items.
+        rv = yield from _insert_smaller(array, rv, [ partner[la] for la in rv ], typecode)
+    return rv
 
+# Steps 4 and 5 of the algorithm described in _merge_insertion_levels: Given the sorted larger elements of the
+# pairs built from `array`, and their smaller partners in the same order, returns all the elements of `array` sorted.
+# To avoid copying, the `larger` sequence is modified in place and returned. `typecode` is the one for the new `ranks` array.
+def _insert_smaller(array :Sequence[int], larger :MutableSequence[int], smaller :Sequence[int], typecode :str) -> _Comparisons[MutableSequence[int]]:
     # Build the "main chain" data structure we will use to insert items into (explained a bit more below), while also:
     # 4. Insert at the start of the sorted sequence the element that was paired with
     #    the first and smallest element of the sorted sequence.
-    # Note that we know the main chain has at least one item here due to the special cases at the beginning of this function.
-    main_chain :list[list[T]] = [ [ pairs[larger[0]] ], [ larger[0] ] ] + [ [ la, pairs[la] ] for la in larger[1:] ]
-    assert all( len(i)==2 for i in main_chain[2:] )
+    # Note that we know the main chain has at least one item here because `array` has more than two items.
+    main_chain = larger
+    main_chain.insert(0, smaller[0])
+    # For each main chain item, the number of `larger` items up to and including it, see explanation below.
+    ranks = _array(typecode, range(len(main_chain)))
 
     # 5. Insert the remaining ⌈n/2⌉−1 items that are not yet in the sorted output sequence into that sequence,
     #    one at a time, with a specially chosen insertion ordering, as follows:
@@ -203,38 +331,58 @@ async def merge_insertion_sort(array :Sequence[T], comparator :Comparator) -> Se
     # item, we know that this smaller item must be inserted *before* that main chain item. The problem I see
     # with the various descriptions is that they don't explicitly explain that the insertion process shifts all
     # the indices of the array, and due to the nonlinear insertion order, this makes it tricky to keep track of
-    # the correct array indices over which to perform the insertion search. So instead, below, I use a linear
-    # search to find the main chain item being operated on each time, which is expensive, but much easier. It
+    # the correct array indices over which to perform the insertion search. So instead, below, I keep a second
+    # list `ranks` in lockstep with the main chain, which for each item holds the number of `larger` items up to
+    # and including that item. Since this list is always in ascending order, the current index of the n-th
+    # `larger` item is the first index whose rank is n, which can be found with a binary search. It
     # should also be noted that the leftover unpaired element, if there is one, gets inserted across the whole
-    # main chain as it exists at the time of its insertion - it may not be inserted last. So even though there
-    # is still some optimization potential, this algorithm is used in cases where the comparisons are much more
-    # expensive than the rest of the algorithm, so the cost is acceptable for now.
-
-    # Iterate over the groups to be inserted, which are built from the main chain as explained above (in the
-    # current implementation we don't need the original indices returned by _make_groups). Also, if there was
-    # a leftover item from an odd input length, treat it as the last "smaller" item. We'll use the fact that
-    # at this point, all main_chain items contain two elements, so we'll mark the leftover item as a special
-    # case by having it be the only item with one element.
-    for _,pair in _make_groups( main_chain[2:] + ( [[array[-1]]] if len(array) % 2 else [] ) ):
+    # main chain as it exists at the time of its insertion - it may not be inserted last.
+
+    # Iterate over the groups to be inserted, which are built from the indices of the `larger` items as explained
+    # above. Also, if there was a leftover item from an odd input length, treat it as the last "smaller" item,
+    # which we can recognize by its index being one past the end of the `smaller` items.
+    for _,i in _make_groups(range(1, len(smaller) + len(array) % 2)):
         # Determine which item to insert and where.
-        if len(pair)==1:  # See explanation of this special case above.
+        if i==len(smaller):  # See explanation of this special case above.
             # This is the leftover item, it gets inserted into the current whole main chain.
-            item = pair[0]
-            idx = await _bin_insert_index([ i[0] for i in main_chain ], item, comparator)
+            item = array[-1]
+            pair_idx = len(main_chain)
         else:
-            assert len(pair)==2
             # Locate the pair we're about to insert in the main chain, to limit the extent of the binary search (see also explanation above).
-            pair_idx = _ident_find(main_chain, pair)
-            item = pair.pop()
-            # Locate the index in the main chain where the pair's smaller item needs to be inserted.
-            idx = await _bin_insert_index([ i[0] for i in main_chain[:pair_idx] ], item, comparator)
-        # Actually do the insertion.
-        main_chain.insert(idx, [item])
-    assert all( len(i)==1 for i in main_chain )
-
-    # Turn the "main chain" data structure back into an array of values.
-    return [ i[0] for i in main_chain ]
-
+            item = smaller[i]
+            pair_idx = bisect_left(ranks, i+1)
+        # Locate the index in the main chain where the item needs to be inserted.
+        idx = yield from _bin_insert_index(main_chain, item, pair_idx)
+        # Actually do the insertion; the new item has the same rank as its predecessor.
+        main_chain.insert(idx, item)
+        ranks.insert(idx, ranks[idx-1] if idx else 0)
+
+    return main_chain
+
+# The decision tree that _merge_insertion_levels follows for n items, as a mapping from the results of all comparisons
+# made so far to either the next list of comparisons or, once there are none left, the sorted indices. It is built by
+# running the algorithm on every possible ordering of the items, so it makes exactly the same comparisons in the same order.
+_DecisionTree = dict[tuple[int, ...], list[tuple[int, int]]|tuple[int, ...]]
+def _decision_tree(n :int) -> _DecisionTree:
+    tree :_DecisionTree = {}
+    for ranks in permutations(range(n)):
+        gen = _merge_insertion_levels(n)
+        path :tuple[int, ...] = ()
+        try:
+            batch = next(gen)
+            while True:
+                tree[path] = batch
+                results :list[Literal[0, 1]] = [ 0 if ranks[a] > ranks[b] else 1 for a,b in batch ]
+                path += tuple(results)
+                batch = gen.send(results)
+        except StopIteration as ex:
+            tree[path] = tuple(ex.value)
+    return tree
+
+# The decision trees for inputs of up to five items, precomputed so _merge_insertion_sort can use them directly.
+_SMALL_TREES :tuple[_DecisionTree, ...] = tuple( _decision_tree(n) for n in range(6) )
+
+@lru_cache(maxsize=None)
 def merge_insertion_max_comparisons(n :int) -> int:
     """Returns the maximum number of comparisons that :func:`merge_insertion_sort` will perform depending on the input length.
 
@@ -243,5 +391,11 @@ def merge_insertion_max_comparisons(n :int) -> int:
     """
     if n<0:
         raise ValueError("must specify zero or more items")
-    # Formula from https://en.wikipedia.org/wiki/Merge-insertion_sort (the sum version should work too)
-    return n*ceil(log2(3*n/4)) - floor((2**floor(log2(6*n)))/3) + floor(log2(6*n)/2) if n else 0
+    if not n:
+        return 0
+    # Formula from https://en.wikipedia.org/wiki/Merge-insertion_sort (the sum version should work too):
+    #   n⌈log₂(3n/4)⌉ − ⌊2^⌊log₂(6n)⌋/3⌋ + ⌊log₂(6n)/2⌋
+    # Implemented with exact integer arithmetic instead of floating-point, which is inaccurate for large n:
+    # ⌊log₂(x)⌋ is `x.bit_length()-1`, and ⌈log₂(3n/4)⌉ = ⌈log₂(3n)⌉-2 where ⌈log₂(x)⌉ is `(x-1).bit_length()`.
+    log2_6n = (6*n).bit_length() - 1
+    return n*((3*n-1).bit_length() - 2) - (1 << log2_6n)//3 + (log2_6n >> 1)
@@ -17,6 +17,7 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 """
 import random
+import asyncio
 import unittest
 from typing import Literal, Optional
 from itertools import islice, permutations
@@ -26,12 +27,6 @@ import merge_insertion as uut
 async def _comp(ab :tuple[str,str]) -> Literal[0,1]:
     return 0 if ab[0] > ab[1] else 1
 
-class AlwaysEqual:
-    """Instances of this class always equal other instances of this class,
-    for testing the difference between equality and object identity."""
-    def __eq__(self, other):
-        return isinstance(other, AlwaysEqual)
-
 class TestMergeInsertionSort(unittest.IsolatedAsyncioTestCase):
 
     def _test_comp(self, comp :uut.Comparator, max_calls :int, log :Optional[list[tuple[uut.T,uut.T]]] = None) -> uut.Comparator:
@@ -58,18 +53,23 @@ class TestMergeInsertionSort(unittest.IsolatedAsyncioTestCase):
             87382, 174762, 349526, 699050, 1398102, 2796202, 5592406, 11184810, 22369622, 44739242,
             89478486, 178956970, 357913942, 715827882, 1431655766, 2863311530, 5726623062, 11453246122 ]
         self.assertEqual( exp, list( islice( group_sizes(), len(exp) ) ) )
+        self.assertEqual( tuple(exp), uut._GROUP_SIZES[:len(exp)] )  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+        self.assertGreater( sum(uut._GROUP_SIZES), 2**64 )  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
 
     def test_make_groups(self):
         make_groups = uut._make_groups  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
         # Wikipedia
-        self.assertEqual( make_groups(['y3','y4','y5','y6','y7','y8','y9','y10','y11','y12','y21','y22']),
+        self.assertEqual( list(make_groups(['y3','y4','y5','y6','y7','y8','y9','y10','y11','y12','y21','y22'])),
             [ (1,'y4'), (0,'y3'),  (3,'y6'), (2,'y5'), (9,'y12'), (8,'y11'), (7,'y10'), (6,'y9'), (5,'y8'), (4,'y7'),  (11,'y22'), (10,'y21') ] )
         # Knuth
-        self.assertEqual( make_groups(['b2','b3','b4','b5','b6','b7','b8','b9','b10','b11']),
+        self.assertEqual( list(make_groups(['b2','b3','b4','b5','b6','b7','b8','b9','b10','b11'])),
             [ (1,'b3'), (0,'b2'),  (3,'b5'), (2,'b4'), (9,'b11'), (8,'b10'), (7,'b9'), (6,'b8'), (5,'b7'), (4,'b6') ] )
         # Ford-Johnson
-        self.assertEqual( make_groups(['1','2','3','4','5','6','7','8','9']),
+        self.assertEqual( list(make_groups(['1','2','3','4','5','6','7','8','9'])),
             [ (1,'2'), (0,'1'),  (3,'4'), (2,'3'), (8,'9'), (7,'8'), (6,'7'), (5,'6'), (4,'5') ] )
+        # edge cases: empty, and ending exactly on a group boundary
+        self.assertEqual( list(make_groups([])), [] )
+        self.assertEqual( list(make_groups('abcd')), [ (1,'b'), (0,'a'),  (3,'d'), (2,'c') ] )
 
     async def test_test_comp(self):
         log :list[tuple[str,str]] = []
@@ -89,20 +89,20 @@ class TestMergeInsertionSort(unittest.IsolatedAsyncioTestCase):
         self.assertEqual( log, [('x','y'), ('x','z')] )
 
     async def test_bin_insert_index(self):
-        bin_insert_index = uut._bin_insert_index  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+        async def bin_insert_index(array :list[str], item :str, comp :uut.Comparator, hi :Optional[int] = None) -> int:
+            # the items are passed to _bin_insert_index as their indices into `items`
+            gen = uut._bin_insert_index(range(len(array)), len(array), hi)  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+            return await uut._run_async(gen, [*array, item], comp, False)  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
 
         #              A B C D E F G H I J K L M N O P Q R S T U V W X Y Z
         a :list[str] = ['B','D','F','H','J','L','N','P','R','T','V','X','Z']
 
-        with self.assertRaises(ValueError):
-            await bin_insert_index(a, 'J', _comp)
-
         # Note that in the JavaScript tests I tested the order of comparisons too, but I didn't port that over here.
         # https://github.com/haukex/merge-insertion.js/blob/main/src/__tests__/merge-insertion.test.ts
 
         # Adapted from <https://en.wikipedia.org/wiki/Binary_search>:
         # while L ≤ R:
-        #   M = L + floor( (R - L) / 2 )
+        #   M = L + floor( (R - L) / 2 )  (equivalent to `(L + R) >> 1` for non-negative integers)
         #   if T < A[M] then:  R = M − 1
         #   else:  L = M + 1
 
@@ -219,15 +219,65 @@ class TestMergeInsertionSort(unittest.IsolatedAsyncioTestCase):
         # 7  6     ins L=7
         self.assertEqual( await bin_insert_index(a[:7], 'O', self._test_comp(_comp,3)), 7 )
 
-    def test_ident_find(self):
-        ident_find = uut._ident_find  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
-        o = AlwaysEqual()
-        a = (1, 'foo', AlwaysEqual(), o)
-        self.assertEqual( a.index(AlwaysEqual()), 2 )
-        self.assertEqual( a.index(o), 2 )
-        self.assertEqual( ident_find(a, o), 3 )
-        with self.assertRaises(IndexError):
-            ident_find(a, AlwaysEqual())
+        # searching only part of the array via `hi` must be the same as searching a slice
+        self.assertEqual( await bin_insert_index(a, 'A', self._test_comp(_comp,0), 0), 0 )
+        self.assertEqual( await bin_insert_index(a, 'C', self._test_comp(_comp,1), 1), 1 )
+        self.assertEqual( await bin_insert_index(a, 'G', self._test_comp(_comp,3), 6), 3 )
+        self.assertEqual( await bin_insert_index(a, 'O', self._test_comp(_comp,3), 7), 7 )
+        self.assertEqual( await bin_insert_index(a, 'Y', self._test_comp(_comp,4), 12), 12 )
+        self.assertEqual( await bin_insert_index(a, 'Y', self._test_comp(_comp,4), None), 12 )
+
+    def test_insert_smaller(self):
+        insert_smaller = uut._insert_smaller  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+        random.seed(654)
+        for ln in range(3, 200):
+            array = random.sample(range(1000), ln)
+            pairs = [ (max(array[i], array[i+1]), min(array[i], array[i+1])) for i in range(0, ln-1, 2) ]
+            pairs.sort()
+            log :list[tuple[int,int]] = []
+            def comp(ab :tuple[int,int]) -> Literal[0,1]:
+                log.append(ab)  # pylint: disable=cell-var-from-loop
+                return 0 if ab[0] > ab[1] else 1
+            gen = insert_smaller(array, [ p[0] for p in pairs ], [ p[1] for p in pairs ], 'I')
+            run_sync = uut._run_sync  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+            self.assertEqual( list(run_sync(gen, range(1000), comp)), sorted(array) )
+            # the binary search for each smaller item must only cover the part of the main chain before its larger partner
+            larger_of = { sm: la for la,sm in pairs }
+            for item, other in log:
+                if item in larger_of:
+                    self.assertLess( other, larger_of[item] )
+
+    def test_small_trees(self):
+        # the decision trees must make exactly the same comparisons in the same batches as the general algorithm
+        general = uut._merge_insertion_levels  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+        fast = uut._merge_insertion_sort  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+        for ln in range(len(uut._SMALL_TREES)):  # pyright: ignore[reportPrivateUsage]  # pylint: disable=protected-access
+            for perm in permutations(range(ln)):
+                batches :list[list[list[tuple[int,int]]]] = [ [], [] ]
+                rvs = []
+                for i, gen in enumerate(( fast(ln), general(ln) )):
+                    try:
+                        batch = next(gen)
+                        while True:
+                            batches[i].append(batch)
+                            batch = gen.send([ 0 if perm[a] > perm[b] else 1 for a,b in batch ])
+                    except StopIteration as ex:
+                        rvs.append(list(ex.value))
+                self.assertEqual( batches[0], batches[1] )
+                self.assertEqual( rvs[0], rvs[1] )
+                self.assertEqual( [ perm[i] for i in rvs[0] ], list(range(ln)) )
+
+    def test_merge_insertion_sort_truthiness(self):
+        # comparators returning other true or false values must work the same for small and large inputs
+        def bcomp(ab :tuple[int,int]) -> bool:
+            return ab[0] < ab[1]
+        def icomp(ab :tuple[int,int]) -> int:
+            return 2 if ab[0] < ab[1] else 0
+        random.seed(246)
+        for ln in range(12):
+            array = random.sample(range(100), ln)
+            for comp in (bcomp, icomp):
+                self.assertEqual( uut.merge_insertion_sort_sync(array, comp), sorted(array) )  # type: ignore[arg-type]
 
     async def test_merge_insertion_sort_detail(self):
         log :list[tuple[str,str]] = []
@@ -251,6 +301,51 @@ class TestMergeInsertionSort(unittest.IsolatedAsyncioTestCase):
         with self.assertRaises(ValueError):
             await uut.merge_insertion_sort('ABB', _comp)
 
+    async def test_merge_insertion_sort_hashing(self):
+        hashes = 0
+        class Item:
+            def __init__(self, val :int):
+                self.val = val
+            def __hash__(self):
+                nonlocal hashes
+                hashes += 1
+                return hash(self.val)
+            def __eq__(self, other):
+                return isinstance(other, Item) and self.val == other.val
+        async def comp(ab :tuple[Item,Item]) -> Literal[0,1]:
+            return 0 if ab[0].val > ab[1].val else 1
+        items = [ Item(x) for x in range(100) ]
+        random.seed(321)
+        random.shuffle(items)
+        self.assertEqual( [ i.val for i in await uut.merge_insertion_sort(items, comp) ], list(range(100)) )
+        # the items are only hashed once each, by the check for duplicates
+        self.assertEqual( hashes, len(items) )
+        # the check for duplicates can be changed to one that doesn't hash the items, or skipped entirely
+        hashes = 0
+        self.assertEqual( [ i.val for i in await uut.merge_insertion_sort(items, comp, check_unique='identity') ], list(range(100)) )
+        self.assertEqual( [ i.val for i in await uut.merge_insertion_sort(items, comp, check_unique=False) ], list(range(100)) )
+        self.assertEqual( [ i.val for i in uut.merge_insertion_sort_sync(items, lambda ab: 0 if ab[0].val > ab[1].val else 1,
+                                                                         check_unique=False) ], list(range(100)) )
+        self.assertEqual( hashes, 0 )
+
+    async def test_merge_insertion_sort_check_unique(self):
+        async def comp(ab :tuple[list[int],list[int]]) -> Literal[0,1]:
+            return 0 if ab[0] > ab[1] else 1
+        # unhashable items
+        a, b, c = [1], [2], [3]
+        with self.assertRaises(TypeError):
+            await uut.merge_insertion_sort([c, a, b], comp)
+        self.assertEqual( await uut.merge_insertion_sort([c, a, b], comp, check_unique='identity'), [a, b, c] )
+        self.assertEqual( uut.merge_insertion_sort_sync([c, a, b], lambda ab: 0 if ab[0] > ab[1] else 1, check_unique='identity'), [a, b, c] )
+        # the identity check only catches the same object occurring more than once
+        with self.assertRaises(ValueError):
+            await uut.merge_insertion_sort([c, a, b, a], comp, check_unique='identity')
+        with self.assertRaises(ValueError):
+            uut.merge_insertion_sort_sync([c, a, b, a], lambda ab: 0 if ab[0] > ab[1] else 1, check_unique='identity')
+        self.assertEqual( await uut.merge_insertion_sort([c, [1], b, [0]], comp, check_unique='identity'), [[0], [1], b, c] )
+        with self.assertRaises(ValueError):
+            await uut.merge_insertion_sort('ABB', _comp, check_unique=True)
+
     async def test_merge_insertion_sort_lengths(self):
         random.seed(123)
         for ln in range(95):
@@ -268,6 +363,53 @@ class TestMergeInsertionSort(unittest.IsolatedAsyncioTestCase):
                 random.shuffle(a)
                 self.assertEqual( await uut.merge_insertion_sort(a, self._test_comp(_comp, uut.merge_insertion_max_comparisons(ln))), array )
 
+    async def test_merge_insertion_sort_parallel(self):
+        running = max_running = 0
+        async def comp(ab :tuple[str,str]) -> Literal[0,1]:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0)
+            running -= 1
+            return await _comp(ab)
+        array = [ chr(x+65) for x in range(26) ]
+        a = array[:]
+        random.seed(456)
+        random.shuffle(a)
+        self.assertEqual( await uut.merge_insertion_sort(a, self._test_comp(comp, uut.merge_insertion_max_comparisons(len(a))),
+            parallel=True), array )
+        self.assertEqual( max_running, len(a)//2 )
+        # without the option, the comparisons don't overlap
+        max_running = 0
+        self.assertEqual( await uut.merge_insertion_sort(a, comp), array )
+        self.assertEqual( max_running, 1 )
+        # the comparisons should happen in the same order either way
+        log_ser :list[tuple[str,str]] = []
+        log_par :list[tuple[str,str]] = []
+        for ln in range(20):
+            self.assertEqual( await uut.merge_insertion_sort(array[:ln], self._test_comp(comp, 9999, log_ser)), array[:ln] )
+            self.assertEqual( await uut.merge_insertion_sort(array[:ln], self._test_comp(comp, 9999, log_par), parallel=True), array[:ln] )
+        self.assertEqual( log_ser, log_par )
+
+    async def test_merge_insertion_sort_sync(self):
+        log :list[tuple[str,str]] = []
+        def scomp(ab :tuple[str,str]) -> Literal[0,1]:
+            log.append(ab)
+            return 0 if ab[0] > ab[1] else 1
+        random.seed(789)
+        for ln in range(50):
+            array = [ chr(x+65) for x in range(ln) ]
+            a = array[:]
+            random.shuffle(a)
+            # the sync version must make exactly the same comparisons as the async version
+            alog :list[tuple[str,str]] = []
+            self.assertEqual( await uut.merge_insertion_sort(a, self._test_comp(_comp, uut.merge_insertion_max_comparisons(ln), alog)), array )
+            log.clear()
+            self.assertEqual( uut.merge_insertion_sort_sync(a, scomp), array )
+            self.assertEqual( log, alog )
+        with self.assertRaises(ValueError):
+            uut.merge_insertion_sort_sync('ABB', scomp)
+
     async def test_merge_insertion_sort_permutations(self):
         # 6! = 720, 7! = 5040, 8! = 40320, 9! = 362880, 10! = 3628800
         for ln in range(9):  # don't increase! (runtime)
@@ -284,3 +426,16 @@ class TestMergeInsertionSort(unittest.IsolatedAsyncioTestCase):
             self.assertEqual( uut.merge_insertion_max_comparisons(i), e )
         with self.assertRaises(ValueError):
             uut.merge_insertion_max_comparisons(-1)
+        # The "sum version" of the formula from Wikipedia: C(n) = Σᵢ₌₁ⁿ ⌈log₂(3i/4)⌉, checked with exact integer math
+        def ceil_log2_3n_4(n :int) -> int:
+            k = 0
+            while 4 * 2**k < 3*n:
+                k += 1
+            return k
+        total = 0
+        for n in range(1, 3000):
+            total += ceil_log2_3n_4(n)
+            self.assertEqual( uut.merge_insertion_max_comparisons(n), total )
+        # Large n, where floating-point math is no longer accurate
+        for n in ( 2**53+1, 2**60+12345, 3*2**70, 10**30 ):
+            self.assertEqual( uut.merge_insertion_max_comparisons(n) - uut.merge_insertion_max_comparisons(n-1), ceil_log2_3n_4(n) )